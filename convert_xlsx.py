@@ -0,0 +1,35 @@
+"""
+Converts the Excel ticker lists into Parquet files, which load much faster than .xlsx.
+
+Run this once whenever one of the Excel files changes:
+    python convert_xlsx.py
+"""
+import pandas as pd
+
+# Excel file, sheet name and Parquet output for each ticker list
+SHEETS = [
+    ("nasdaqlist.xlsx", "Sheet1", "nasdaqlist_sheet1.parquet"),
+    ("nasdaqlist.xlsx", "Sheet2", "nasdaqlist_sheet2.parquet"),
+    ("nyse.xlsx", "nyse", "nyse.parquet"),
+    ("crypto.xlsx", "coinmarketcap", "crypto.parquet"),
+]
+
+def convert_sheet(filepath, sheet, output):
+    """
+    Converts a single Excel sheet into a Parquet file.
+
+    Args:
+        filepath (str): The Excel file to read.
+        sheet (str): The name of the sheet to convert.
+        output (str): The Parquet file to write.
+    """
+    df = pd.read_excel(filepath, sheet_name=sheet, header=None)
+    # Parquet needs string column names and a single type per column, so store
+    # every cell as the text the app's parsers would read from it
+    df.columns = df.columns.astype(str)
+    df.astype(str).to_parquet(output, index=False)
+    print(f"Converted {filepath} ({sheet}) to {output}: {len(df)} rows")
+
+if __name__ == "__main__":
+    for filepath, sheet, output in SHEETS:
+        convert_sheet(filepath, sheet, output)
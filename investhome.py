@@ -1,15 +1,65 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 import yfinance as yf
+import requests
+import io
 import logging
-from functools import lru_cache
-from tenacity import retry, stop_after_attempt
+import math
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+
+# Maximum number of stock returns fetched at the same time
+MAX_FETCH_WORKERS = 10
+# Seconds any single Yahoo Finance request may take before it fails
+FETCH_TIMEOUT = 3
+
+@st.cache_resource(show_spinner=False)
+def _init():
+    """
+    Configures third-party libraries once per server process instead of on every rerun.
+    
+    Returns:
+        bool: Always True, so the cached call only runs once.
+    """
+    # Suppress yfinance console logging
+    logging.getLogger('yfinance').setLevel(logging.CRITICAL)
+    return True
 
-# Suppress yfinance console logging
-logging.getLogger('yfinance').setLevel(logging.CRITICAL)
+_init()
 
-@retry(stop=stop_after_attempt(3))
-@lru_cache(maxsize=128)
+class _TimeoutAdapter(HTTPAdapter):
+    """
+    HTTP adapter that bounds every request it sends by FETCH_TIMEOUT.
+    
+    yfinance only forwards the history() timeout to the chart request and hard-codes longer ones
+    (10 s for the timezone, 30 s for the cookie and crumb), so the bound is applied here instead.
+    """
+    def send(self, request, **kwargs):
+        timeout = kwargs.get("timeout")
+        if timeout is None or isinstance(timeout, tuple) or timeout > FETCH_TIMEOUT:
+            kwargs["timeout"] = FETCH_TIMEOUT
+        return super().send(request, **kwargs)
+
+@st.cache_resource(show_spinner=False)
+def _get_session():
+    """
+    Creates the HTTP session shared by all Yahoo Finance requests of the server process.
+    
+    Returns:
+        requests.Session: A session without retries, with every request bounded by FETCH_TIMEOUT
+        and a connection pool for each fetch worker.
+    """
+    session = requests.Session()
+    adapter = _TimeoutAdapter(max_retries=0, pool_connections=MAX_FETCH_WORKERS, pool_maxsize=MAX_FETCH_WORKERS)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+# Cached across reruns and sessions for an hour, including the default rate on failures
+@st.cache_data(ttl=3600, show_spinner=False)
 def get_stock_return(stock_symbol):
     """
     Fetches historical stock data to calculate the compounded annual growth rate (CAGR).
@@ -21,9 +71,13 @@ def get_stock_return(stock_symbol):
         float: The calculated annual return. Returns a default of 7% if an error occurs.
     """
     try:
-        stock_data = yf.Ticker(stock_symbol)
-        # Fetch data for the last 5 years
-        hist = stock_data.history(period="5y")
+        stock_data = yf.Ticker(stock_symbol, session=_get_session())
+        # Fetch weekly data for the last 5 years, skipping the dividend and split columns since only closes are used.
+        # The CAGR only depends on the first and last closes, so weekly bars give the same rate as daily
+        # ones within a few basis points while downloading about a fifth of the rows.
+        # Every request yfinance makes on the shared session is bounded by FETCH_TIMEOUT and failures use the
+        # default rate, though a failing fetch can still make a few such requests (e.g. a cookie strategy retry).
+        hist = stock_data.history(period="5y", interval="1wk", actions=False)
         if hist.empty:
             st.warning(f"No historical data found for {stock_symbol}. Using default return rate.")
             return 0.07
@@ -42,12 +96,88 @@ def get_stock_return(stock_symbol):
             st.warning(f"Investment period for {stock_symbol} is less than a year. Using default rate.")
             return 0.07
 
+        # A zero first or last close would give an infinite or -100% rate that cannot be projected
+        if initial_price <= 0 or final_price <= 0:
+            st.warning(f"Unusable price history for {stock_symbol}. Using default return rate.")
+            return 0.07
+
         annual_return = (final_price / initial_price) ** (1 / num_years) - 1
+        if not np.isfinite(annual_return):
+            st.warning(f"Unusable price history for {stock_symbol}. Using default return rate.")
+            return 0.07
         return annual_return
     except Exception as e:
         st.warning(f"Error fetching data for {stock_symbol}: {e}. Using default return rate.")
         return 0.07  # Default 7% for equity
 
+def prefetch_returns(symbols):
+    """
+    Fetches the annual returns for several stock symbols concurrently.
+    
+    Args:
+        symbols (list[str]): The stock symbols to fetch returns for.
+        
+    Returns:
+        dict: A dictionary mapping each unique symbol to its calculated annual return.
+    """
+    symbols = list(dict.fromkeys(symbols))  # Remove duplicates while keeping order
+    if not symbols:
+        return {}
+
+    # Attach the script context to the worker threads so their warnings still reach the page
+    ctx = get_script_run_ctx()
+    with ThreadPoolExecutor(
+        max_workers=min(MAX_FETCH_WORKERS, len(symbols)),
+        initializer=lambda: add_script_run_ctx(threading.current_thread(), ctx)
+    ) as executor:
+        return dict(zip(symbols, executor.map(get_stock_return, symbols)))
+
+# Returns fetched for the options chosen in the current run only: Streamlit re-executes the script on
+# every rerun, so this starts empty each time and get_stock_return's cache is what persists across runs
+run_returns = {}
+
+def batch_get_returns(symbols):
+    """
+    Fetches the annual returns for all chosen stock symbols in one pass and stores them for later lookups.
+    
+    Args:
+        symbols (list[str]): The stock symbols to fetch returns for.
+        
+    Returns:
+        dict: A dictionary mapping each symbol to its calculated annual return.
+    """
+    missing = list(dict.fromkeys(symbol for symbol in symbols if symbol not in run_returns))
+    if len(missing) == 1:
+        # A single symbol is not worth starting a thread pool for
+        run_returns[missing[0]] = get_stock_return(missing[0])
+    elif missing:
+        run_returns.update(prefetch_returns(missing))
+    return {symbol: run_returns[symbol] for symbol in symbols}
+
+def resolve_option_return(option, investment_options, option_symbols):
+    """
+    Resolves the annual return of an investment option, fetching stocks only if they were not part of the batch.
+    
+    Args:
+        option (str): The name of the investment option.
+        investment_options (dict): The fixed rate of each investment option, or None if it tracks a stock.
+        option_symbols (dict): The stock symbol of each investment option that tracks a stock.
+        
+    Returns:
+        float: The annual return of the option.
+    """
+    fixed_rate = investment_options[option]
+    if fixed_rate is not None:
+        return fixed_rate
+    symbol = option_symbols[option]
+    if symbol in run_returns:
+        return run_returns[symbol]
+    return get_stock_return(symbol)
+
+# Suffix and divisor for each power of a thousand
+_SUFFIX = ("", "K", "M", "B", "T")
+_DIV = (1, 1e3, 1e6, 1e9, 1e12)
+
 def format_in_millions_billions_trillions(value):
     """
     Formats a numerical value into a string representation in millions, billions, or trillions.
@@ -58,14 +188,15 @@ def format_in_millions_billions_trillions(value):
     Returns:
         str: A formatted string with 'M', 'B', or 'T' suffix for millions, billions, or trillions.
     """
-    if value >= 1_000_000_000_000:  # If value is 1 trillion or more
-        return f"${value / 1_000_000_000_000:.2f}T"
-    elif value >= 1_000_000_000:  # If value is 1 billion or more
-        return f"${value / 1_000_000_000:.2f}B"
-    elif value >= 1_000_000:  # If value is 1 million or more
-        return f"${value / 1_000_000:.2f}M"
-    else:
+    if math.isnan(value) or value < 1_000_000:
         return f"${value:,.2f}"  # For values less than 1 million, format normally
+    if math.isinf(value):
+        return f"${value:.2f}T"  # log10 cannot size an infinite projection
+    # Pick the suffix from the number of thousands groups, capped at trillions
+    magnitude = min(4, int(math.log10(value)) // 3)
+    if value < _DIV[magnitude]:  # log10 can round up just below a power of ten
+        magnitude -= 1
+    return f"${value / _DIV[magnitude]:.2f}{_SUFFIX[magnitude]}"
 
 
 def adjust_for_inflation(rate, inflation_rate):
@@ -95,71 +226,182 @@ def cap_growth_assumption(rate, min_rate=0.02, max_rate=0.2):
     """
     return max(min(rate, max_rate), min_rate)
 
-def get_Investmentoption(exchange):
+def project(initial_savings, annual_contribution, rate, years):
     """
-    Retrieves a dictionary of investment options based on the selected stock exchange.
+    Projects savings year by year using the closed-form future value of an annuity.
     
     Args:
-        exchange (str): The stock exchange to get options for ("NASDAQ", "TSX TORONTO", "NYSE", "CRYPTO").
+        initial_savings (float): The savings at the start of the projection.
+        annual_contribution (float): The amount contributed at the end of each year.
+        rate (float): The annual return rate.
+        years (int): The number of years to project.
         
     Returns:
-        dict: A dictionary of investment options with their corresponding return calculation functions.
+        numpy.ndarray: The total savings at the end of each year, starting with the initial savings.
     """
-    # Start with a base set of common investment options
-    investment_options = {
-        "S&P 500 Index Fund (ETF)": lambda: get_stock_return("SPY"),
-        "Nasdaq ETF (QQQ)": lambda: get_stock_return("QQQ"),
-        "Bitcoin (BTC)": lambda: get_stock_return("BTC-USD"),
-        "Ethereum (ETH)": lambda: get_stock_return("ETH-USD"),
-        "Government Bond (10-year)": lambda: 0.03,
-        "Corporate Bond (10-year)": lambda: 0.05,
-        "Custom": None
-    }
+    return project_many(initial_savings, annual_contribution, [rate], years)[0]
+
+def project_many(initial_savings, annual_contribution, rates, years):
+    """
+    Projects savings for several annual return rates at once.
+    
+    Args:
+        initial_savings (float): The savings at the start of the projection.
+        annual_contribution (float): The amount contributed at the end of each year.
+        rates (list[float]): The annual return rates to project.
+        years (int): The number of years to project.
+        
+    Returns:
+        numpy.ndarray: A (len(rates), years + 1) matrix with the total savings of each rate per year.
+    """
+    rates = np.asarray(rates, dtype=float)[:, np.newaxis]
+    t = np.arange(years + 1)
+    # (1 + rate) ** t for every rate and year in one vectorized exp, with expm1 keeping
+    # (1 + rate) ** t - 1 accurate for small rates
+    valid = rates > -1
+    exponent = np.log1p(np.where(valid, rates, 0)) * t
+    # log1p is undefined at or below -100% (e.g. an inflation-adjusted -95% coin), so
+    # those rates fall back to plain powers, which alternate sign below -100%
+    growth_factor = np.where(valid, np.exp(exponent), np.power(1 + rates, t))
+    growth_minus_one = np.where(valid, np.expm1(exponent), growth_factor - 1)
+    # Sum of the compounded contributions, which is simply t for a zero rate
+    annuity_factor = np.divide(growth_minus_one, rates,
+                               out=np.broadcast_to(t, growth_factor.shape).astype(float),
+                               where=rates != 0)
+    # Year 0 is always the initial savings, even where log1p(rate) * 0 is NaN (infinite rate)
+    growth_factor[:, 0] = 1
+    annuity_factor[:, 0] = 0
+    return initial_savings * growth_factor + annual_contribution * annuity_factor
+
+@st.cache_resource(show_spinner=False)
+def _load_exchange_options(exchange):
+    """
+    Loads the stocks listed for an exchange from its Parquet file, parsed once and shared across reruns.
+    
+    Args:
+        exchange (str): The stock exchange to load ("NASDAQ", "TSX TORONTO", "NYSE", "CRYPTO").
+        
+    Returns:
+        dict: A dictionary mapping each stock description to its symbol. Callers must not modify it.
+    """
+    exchange_options = {}
 
-    # Helper function to load and process data from Excel files
-    def load_options_from_excel(filepath, sheet, parser_func):
+    # Helper function to load and process data from the Parquet files built by convert_xlsx.py
+    def load_options_from_parquet(filepath, parser_func):
         try:
-            df = pd.read_excel(filepath, sheet_name=sheet, header=None)
-            for _, row in df.iterrows():
-                try:
-                    symbol, description = parser_func(row)
-                    if symbol and description:
-                        # Use a lambda with a default argument to correctly capture the symbol
-                        investment_options[description] = lambda s=symbol: get_stock_return(s)
-                except (IndexError, ValueError):
-                    # Skip rows that are malformed
-                    continue
+            df = pd.read_parquet(filepath)
+            symbols, descriptions = parser_func(df)
+            # Skip rows that are malformed or missing a symbol or description
+            valid = symbols.notna() & descriptions.notna() & (symbols != "") & (descriptions != "")
+            exchange_options.update(zip(descriptions[valid], symbols[valid]))
         except FileNotFoundError:
             st.warning(f"Data file not found: {filepath}. Some investment options may be missing.")
         except Exception as e:
             st.error(f"Error reading {filepath}: {e}")
 
-    # Define parsers for different file formats
-    def parse_nasdaq(row):
-        parts = row[0].split("|")
-        return parts[0], parts[1]
+    # Define parsers that split each file format into symbol and description columns
+    def parse_nasdaq(df):
+        parts = df.iloc[:, 0].str.split("|")
+        return parts.str[0], parts.str[1]
 
-    def parse_nyse(row):
-        return str(row[0]).strip(), str(row[1]).strip()
+    def parse_nyse(df):
+        return df.iloc[:, 0].astype(str).str.strip(), df.iloc[:, 1].astype(str).str.strip()
 
-    def parse_crypto(row):
-        symbol = str(row[0]).strip()
-        description = str(row[1]).strip()
-        return f"{symbol}-USD", description
+    def parse_crypto(df):
+        symbols = df.iloc[:, 0].astype(str).str.strip()
+        descriptions = df.iloc[:, 1].astype(str).str.strip()
+        return symbols + "-USD", descriptions
 
-    # Load additional options based on the selected exchange
+    # Load the options of the selected exchange
     if exchange == "NASDAQ":
-        load_options_from_excel("nasdaqlist.xlsx", "Sheet1", parse_nasdaq)
+        load_options_from_parquet("nasdaqlist_sheet1.parquet", parse_nasdaq)
     elif exchange == "TSX TORONTO":
-        load_options_from_excel("nasdaqlist.xlsx", "Sheet2", parse_nasdaq)
+        load_options_from_parquet("nasdaqlist_sheet2.parquet", parse_nasdaq)
     elif exchange == "NYSE":
-        load_options_from_excel("nyse.xlsx", "nyse", parse_nyse)
+        load_options_from_parquet("nyse.parquet", parse_nyse)
     elif exchange == "CRYPTO":
-        load_options_from_excel("crypto.xlsx", "coinmarketcap", parse_crypto)
+        load_options_from_parquet("crypto.parquet", parse_crypto)
 
-    return investment_options
+    return exchange_options
 
+def get_Investmentoption(exchange):
+    """
+    Retrieves a dictionary of investment options based on the selected stock exchange.
+    
+    Args:
+        exchange (str): The stock exchange to get options for ("NASDAQ", "TSX TORONTO", "NYSE", "CRYPTO").
+        
+    Returns:
+        tuple: A dictionary with the fixed rate of each investment option, or None if its rate comes
+        from a stock or is entered by the user, and a dictionary with the stock symbol of each option
+        that tracks a stock.
+    """
+    # Start with a base set of common investment options
+    investment_options = {
+        "S&P 500 Index Fund (ETF)": None,
+        "Nasdaq ETF (QQQ)": None,
+        "Bitcoin (BTC)": None,
+        "Ethereum (ETH)": None,
+        "Government Bond (10-year)": 0.03,
+        "Corporate Bond (10-year)": 0.05,
+        "Custom": None
+    }
+    option_symbols = {
+        "S&P 500 Index Fund (ETF)": "SPY",
+        "Nasdaq ETF (QQQ)": "QQQ",
+        "Bitcoin (BTC)": "BTC-USD",
+        "Ethereum (ETH)": "ETH-USD",
+    }
+
+    # Add the stocks of the selected exchange; returns are only fetched once an option is chosen
+    exchange_options = _load_exchange_options(exchange)
+    investment_options.update(dict.fromkeys(exchange_options))
+    option_symbols.update(exchange_options)
+
+    return investment_options, option_symbols
+
+
+
+def build_comparison(start_age, initial_savings, annual_contribution, years, options_and_rates):
+    """
+    Builds the projection chart data and metrics for the compared investment options.
+    
+    Args:
+        start_age (int): The age at the start of the projection.
+        initial_savings (float): The savings at the start of the projection.
+        annual_contribution (float): The amount contributed at the end of each year.
+        years (int): The number of years to project.
+        options_and_rates (tuple): The (option, annual return rate) pairs to compare, in display order.
+        
+    Returns:
+        tuple: A DataFrame with the savings of each option per year, and a list of metrics per option.
+    """
+    # Calculate projections for all compared options at once
+    options = [option for option, _ in options_and_rates]
+    rates = [rate for _, rate in options_and_rates]
+    comparison_savings = project_many(initial_savings, annual_contribution, rates, years)
+
+    # Build the chart data in one go, with one column per option, instead of inserting columns one by one
+    comparison_data = pd.DataFrame(comparison_savings.T, columns=options)
+    comparison_data.insert(0, "Year", start_age + np.arange(years + 1))
+
+    comparison_metrics = []
+    for (option, return_rate), option_savings in zip(options_and_rates, comparison_savings):
+        total_option_contributions = annual_contribution * years
+        total_option_savings = option_savings[-1]
+        if initial_savings > 0 and years > 0:
+            option_cagr = ((total_option_savings / initial_savings) ** (1 / years)) - 1
+        else:
+            option_cagr = 0
+        comparison_metrics.append({
+            "Option": option,
+            "Annual Return (%)": f"{return_rate * 100:.2f}%",
+            "Total contributions": format_in_millions_billions_trillions(total_option_contributions),
+            "Total Savings": format_in_millions_billions_trillions(total_option_savings),
+            "CAGR": f"{option_cagr * 100:.2f}%",
+        })
 
+    return comparison_data, comparison_metrics
 
 
 # --- Streamlit UI Configuration ---
@@ -207,13 +449,18 @@ if selected_feature == "Retirement Calculator":
 
     # Investment option selection
     selected_exchange = st.sidebar.selectbox("Select Exchange", ["NASDAQ", "TSX TORONTO", "NYSE", "CRYPTO"])
-    investment_options = get_Investmentoption(selected_exchange)
+    investment_options, option_symbols = get_Investmentoption(selected_exchange)
     selected_option = st.sidebar.selectbox("Search and Select Investment option", list(investment_options.keys()))
+
+    # Fetch the returns of the selected and compared stocks together before they are used
+    chosen_options = [selected_option] + st.session_state.get("comparison_options", [])
+    batch_get_returns([option_symbols[option] for option in chosen_options if option in option_symbols])
+
     manual_return = 0.0
     if selected_option == "Custom":
         manual_return = st.sidebar.number_input("Enter Expected Annual Return (%)", min_value=0.0, max_value=100.0, value=5.0, step=0.1) / 100
     else:
-        manual_return = investment_options[selected_option]()
+        manual_return = resolve_option_return(selected_option, investment_options, option_symbols)
 
     # # Apply growth capping (currently commented out)
     # manual_return = cap_growth_assumption(manual_return)
@@ -226,24 +473,19 @@ if selected_feature == "Retirement Calculator":
 
     # --- Savings Projection Calculation ---
     years_to_invest = retirement_age - current_age
-    savings = [current_savings]
-    contributions = [0]
-    growth = [0]
+    savings = project(current_savings, annual_contribution, manual_return, years_to_invest)
 
-    # Loop through each year to calculate savings growth
-    for year in range(1, years_to_invest + 1):
-        annual_growth = savings[-1] * manual_return
-        contributions.append(annual_contribution)
-        growth.append(annual_growth)
-        savings.append(savings[-1] + annual_contribution + annual_growth)
+    # Cumulative contributions and growth for each year, kept as raw arrays for the DataFrame
+    elapsed_years = np.arange(years_to_invest + 1)
+    contributions = annual_contribution * elapsed_years
+    growth = savings - current_savings - contributions
 
     # --- Data Visualization and Metrics ---
-    years = list(range(current_age, retirement_age + 1))
     df = pd.DataFrame({
-        "Year": years,
+        "Year": current_age + elapsed_years,
         "Total Savings": savings,
-        "Contributions": pd.Series(contributions).cumsum(),
-        "Growth": pd.Series(growth).cumsum()
+        "Contributions": contributions,
+        "Growth": growth
     })
 
     # Display the savings projection chart
@@ -251,7 +493,7 @@ if selected_feature == "Retirement Calculator":
     st.line_chart(df.set_index("Year")[["Contributions", "Total Savings"]])
 
     # --- Key Metrics Display ---
-    total_contributions = sum(contributions)
+    total_contributions = contributions[-1]
     total_growth = savings[-1] - total_contributions - current_savings
 
     # Calculate Compound Annual Growth Rate (CAGR)
@@ -278,34 +520,31 @@ if selected_feature == "Retirement Calculator":
     comparison_options = st.multiselect(
         "Select Investment Options to Compare",
         list(investment_options.keys()),
-        default=[selected_option]
+        default=[selected_option],
+        key="comparison_options"
     )
 
-    comparison_data = pd.DataFrame({"Year": years})
-    comparison_metrics = []
+    # Fetch any compared stocks that were not part of the batch yet, e.g. right after the first run
+    comparison_symbols = [option_symbols[option] for option in comparison_options if option in option_symbols]
+    if not run_returns.keys() >= set(comparison_symbols):
+        batch_get_returns(comparison_symbols)
 
-    # Calculate projections for each selected comparison option
+    # Resolve the return rate of each compared option once
+    rate_by_option = {}
     for option in comparison_options:
-        return_rate = investment_options[option]() if option != "Custom" else manual_return
-        option_savings = [current_savings]
-        for year in range(1, years_to_invest + 1):
-            option_savings.append(option_savings[-1] * (1 + return_rate) + annual_contribution)
-        total_option_contributions = annual_contribution * years_to_invest
-        total_option_savings = option_savings[-1]
-        total_option_returns = total_option_savings - total_option_contributions - current_savings
-        comparison_data[option] = option_savings
-        if current_savings > 0 and years_to_invest > 0:
-            option_cagr = ((total_option_savings / current_savings) ** (1 / years_to_invest)) - 1
+        if option in rate_by_option:
+            continue
+        if option == "Custom":
+            rate_by_option[option] = manual_return
         else:
-            option_cagr = 0
-        comparison_metrics.append({
-            "Option": option,
-            "Annual Return (%)": f"{return_rate * 100:.2f}%",
-            "Total contributions": format_in_millions_billions_trillions(total_option_contributions),
-            "Total Savings": format_in_millions_billions_trillions(total_option_savings),
-            "CAGR": f"{option_cagr * 100:.2f}%",
-        })
-        
+            rate_by_option[option] = resolve_option_return(option, investment_options, option_symbols)
+
+    # Build the comparison chart data and metrics from the resolved rates
+    comparison_data, comparison_metrics = build_comparison(
+        current_age, current_savings, annual_contribution, years_to_invest,
+        tuple((option, rate_by_option[option]) for option in comparison_options)
+    )
+
     if comparison_metrics:
         # Display comparison chart and metrics table
         st.line_chart(comparison_data.set_index("Year"))
@@ -313,8 +552,10 @@ if selected_feature == "Retirement Calculator":
 
     # --- Data Export ---
     st.subheader("Export Data")
-    csv = df.to_csv(index=False)
-    st.download_button(label="Download Projection as CSV", data=csv, file_name="savings_projection.csv", mime="text/csv")
+    # Write the CSV straight to bytes, with amounts rounded to cents
+    csv_buffer = io.BytesIO()
+    df.to_csv(csv_buffer, index=False, float_format="%.2f")
+    st.download_button(label="Download Projection as CSV", data=csv_buffer.getvalue(), file_name="savings_projection.csv", mime="text/csv")
 
     # --- Styling and Layout ---
     # Custom CSS for responsive design